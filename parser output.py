@@ -1,211 +1,631 @@
-# Import libraries
-import csv
-import time
-import warnings
-import pandas as pd
-import requests
-from ollama import chat
-from pydantic import BaseModel
-warnings.filterwarnings('ignore')
-
-# Header for SEC EDGAR requests
-headers = {'User-Agent': 'Alex Reyes reyesale@umich.edu'}
-
-def obtain_urls(year, quarter, form, total_forms, company_list):
-
-    """
-    This function obtains specified forms for provided companies from the SEC EDGAR Website
-
-    Input descriptions:
-    year: in format 20XX as an integer
-    quarter: as a string in format "QTR#" where # is 1, 2, 3, or 4
-    form: string that is either "8-K", "10-K" or "10-Q"
-    total_forms: the number of total forms to parse as an integer
-    company_list: is a dictionary where the key is the company's name as a string
-                  and the value is a list of strings in the form ['CIK#', 'Ticker']
-
-    Output will be a list of lists containing ['Form URL', 'Company Name', 'Company Ticker']
-    """
-
-    # Download SEC EDGAR master data file containing all company form submissions for specified year/quarter #
-    master_data = requests.get(
-        f'https://www.sec.gov/Archives/edgar/full-index/{year}/{quarter}/master.idx', stream=True,
-        headers=headers).content
-
-    # Decode the master data file and split it by lines
-    master_data = master_data.decode("utf-8").split('\n')
-
-    # create list to store form urls
-    form_urls = []
-
-    for name, CIK in company_list.items():
-        print(f"Processing {name} for {form} urls.")
-
-        # Iterate through the master data lines row by row to find lines that include
-        # the companies provided in company_list as input to this function
-        for line in master_data:
-
-            # This will check we are only collecting the specified total # of forms
-            # Stop if we have the requested amount of forms
-            if len(form_urls) >= total_forms:
-                break
-
-            # This will select lines of the master file that contain names of the
-            # companies listed in our input file company_list
-            if (name.lower() in line.lower()) and (form in line):
-                line_info = line.strip()
-                line_split = line_info.split('|')
-
-                # Obtain portion of url from line to build full url later on
-                url = line_split[-1]
-
-                url2 = url.replace("-", "").replace(".txt", "")
-                htm_url = 'https://www.sec.gov/Archives/' + url
-
-                # Request the form data and get the filename
-                company_form_data = requests.get(htm_url, stream=True, headers=headers).text
-                company_form_data = company_form_data.split('FILENAME>')
-                company_form_data = company_form_data[1].split('\n')[0]
-
-                # Generate the finalized .htm URL
-                company_form_url = 'https://www.sec.gov/Archives/' + url2 + '/' + company_form_data
-
-                # Request the 8-K filing page with except error handling
-                try:
-                    response = requests.get(company_form_url, headers=headers)
-
-                    # If we find the above regex in the file, we can then extract the 8-K press release url
-                    form_urls.append([company_form_url, name, CIK[1]])
-                    print(f"Found press release URL for {name}: {company_form_url}")
-
-                except requests.RequestException as e:
-                    print(f"Error fetching {company_form_url}: {e}")
-                    continue
-
-        # Recheck once we have broken out of inner loop to avoid
-        # looping through another company
-        if len(form_urls) >= total_forms:
-            break
-
-    print(f"\nCollected {len(form_urls)} valid form {form} URLs.")
-
-    # Return the collected press release URLs
-    return form_urls
-
-##################################################################################################################################################################################
-##################################################################################################################################################################################
-
-def llm_parser(documents):
-    """
-    This function takes a list containing lists [urls, stock names,tickers] as input and returns a list
-    of llm response outputs for each company form url in the input list.
-    """
-
-    # Timing how long total llm parsing and output will take
-    start_time = time.time()
-
-    # Create a structured output class for the llm response
-    class DocumentOutput(BaseModel):
-        date_of_report: str
-        new_product: str
-        product_description: str
-
-    # Create list of lists to store llm outputs. First list will be row names since we will export to CSV
-    output_list = [["company_name", "stock_name", "filing_time", "new_product", "product_description"]]
-
-    # Iterate through the urls obtained from obtain_urls function
-    for line_info in documents:
-
-        url = line_info[0]
-
-        # format name for file downloaded from each url as url name
-        file_content = requests.get(url, stream=True, headers=headers).text
-
-        # Create prompt to provide as input to the llm
-        prompt = (
-                f"Read the following file content and provide the following details:\n"
-                f"- Date of the report\n"
-                f"- Name of new product mentioned\n"
-                f"- Description of the new product\n\n"
-                f"Content:\n{file_content}\n\n"
-                f"IMPORTANT RULES:\n"
-                f"1. The New Product Description MUST be summarized in 180 characters or less.\n"
-                f"2. Generic product names such as 'New Product 1' or similar names are NOT considered new products. Only list products with specific names.\n"
-                f"3. Acquiring another business or business unit is NOT considered a new product.\n"
-                f"4. If no new products are mentioned, output the following:\n"
-                f"   - New Product: none\n"
-                f"   - Product Description: No new products mentioned.\n"
-                f"5. Senior notes due or common stock are NOT considered new products. .\n"
-                f"6. Do not provide reasoning, explanations, or your thinking in the output.\n"
-            )
-
-
-        # Store response from llm model
-        # Available models are llama3.2:3b, deepseek-r1:14b, deepseek-r1:8b
-        llm_response = chat(model='deepseek-r1:8b', messages=[
-            {
-               'role': 'user',
-                'content': prompt,
-                'temperature': 0.2,
-                'top_k': 10
-            }
-        ],
-                            format=DocumentOutput.model_json_schema(),
-                            )
-
-        # Format llm response in specified format from DocumentOutput class above
-        doc_output = DocumentOutput.model_validate_json(llm_response.message.content)
-
-        # Append llm response to output list that will be written to CSV file
-        output_list.append([line_info[1], line_info[2], doc_output.date_of_report,
-                            doc_output.new_product.replace("&amp;", "and"),
-                            doc_output.product_description.replace("&amp;", "and")])
-
-    # If any products or descriptions were incorrectly left blank, enter in
-    # correct description and name as none. We skip the header row.
-    for row in output_list[1:]:
-        if not row[3].strip():
-            row[3] = "none"
-        if not row[4].strip():
-            row[4] = "No new products mentioned."
-
-    # calculate total time for llm chat responses
-    elapsed_time = time.time() - start_time
-    print(f"Time taken for the chat operation: {elapsed_time:.2f} seconds")
-
-    return output_list
-
-##################################################################################################################################################################################
-##################################################################################################################################################################################
-
-def write_to_csv(parser_results):
-
-    # Write the results form the llm to parser_output.csv file
-    with open('testoutput.csv', "w", newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(parser_results)
-
-##################################################################################################################################################################################
-##################################################################################################################################################################################
-
-if __name__ == "__main__":
-
-    # Read in SPY500 company data to obtain names, ciks, and tickers
-    tickers = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
-
-    # Create dictionary of company names, ciks, and tickers
-    spy_companies = {}
-    for i in range(0, len(tickers)):
-        spy_companies[str(tickers.iloc[i]['Security'])] = [str(tickers.iloc[i]["CIK"]), str(tickers.iloc[i]["Symbol"])]
-
-    # Add leading 0s to CIKs per SEC website guidance
-    for ticker in spy_companies:
-        spy_companies[ticker][0] = spy_companies[ticker][0].zfill(10)
-
-    # Running the functions on the dictionary of requested companies
-    # In this case, we are using SPY500 companies
-
-    # Available form requests: '8-K', '10-K', or '10-Q'
-    url_list = obtain_urls(2024, "QTR4", "8-K", 100, spy_companies)
-    results = llm_parser(url_list)
-    write_to_csv(results)
\ No newline at end of file
+# Import libraries
+import asyncio
+import csv
+import io
+import os
+import re
+import time
+import warnings
+from datetime import date
+import aiohttp
+import orjson
+import pandas as pd
+from bs4 import BeautifulSoup
+from tqdm import tqdm
+from ollama import AsyncClient
+from pydantic import BaseModel
+warnings.filterwarnings('ignore')
+
+# Header for SEC EDGAR requests
+headers = {'User-Agent': 'Alex Reyes reyesale@umich.edu'}
+
+# Base of all EDGAR archive urls, hoisted out of the per-filing path
+ARCHIVE = 'https://www.sec.gov/Archives/'
+
+# Strips the dashes and .txt suffix that turn an idx filename into its directory name
+TRIM = re.compile(r'-|\.txt$')
+
+# Retry settings for EDGAR requests that come back as rate-limited or server errors
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Directory for files cached between runs
+CACHE_DIR = 'cache'
+
+# How long the cached S&P500 list stays fresh before Wikipedia is re-fetched;
+# index membership changes rarely, so a month is plenty
+SPY500_MAX_AGE = 30 * 24 * 60 * 60
+
+# SEC EDGAR's published request-rate guideline
+MAX_REQUESTS_PER_SECOND = 10
+
+class RateLimiter:
+
+    """
+    This class is an async token bucket that caps how many requests start per second.
+    Tokens accrue continuously at the configured rate up to a burst of one second's
+    worth, so concurrency stays high while the SEC 10 requests/second guideline is
+    guaranteed, without sleeping a fixed delay after every request.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        async with self.lock:
+            while True:
+                # Top the bucket up with the tokens accrued since the last request
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return self
+
+                # Sleep just long enough for the next token to accrue
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+def quarter_is_closed(year, quarter):
+
+    """
+    This function returns True once the given "QTR#" quarter of the given year has
+    ended. Closed quarters never change on EDGAR, so their index files are safe to
+    cache forever; the current quarter still gains filings and must be re-fetched.
+    """
+
+    end_month = int(quarter[-1]) * 3
+    if end_month == 12:
+        first_day_after = date(year + 1, 1, 1)
+    else:
+        first_day_after = date(year, end_month + 1, 1)
+    return date.today() >= first_day_after
+
+def make_session():
+
+    """
+    This function creates the single aiohttp session shared by all EDGAR requests in a run.
+    The EDGAR headers are preset on the session and the connector keeps up to 10 pooled
+    keep-alive connections, so every request after the first reuses an open TCP + TLS
+    connection instead of paying the handshake again.
+    """
+
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=10), headers=headers)
+
+async def fetch(session, limiter, url):
+
+    """
+    This function downloads a single url with the shared aiohttp session and returns
+    the response body as text. All EDGAR requests go through here so they can be
+    overlapped with asyncio.gather instead of blocking one at a time. The limiter
+    gates each attempt so total request starts stay under the SEC rate guideline,
+    and rate-limited and server error responses are retried with backoff. Error
+    statuses raise so gather(return_exceptions=True) callers see the failure
+    instead of an EDGAR error page as the body.
+    """
+
+    for attempt in range(RETRY_TOTAL):
+        async with limiter:
+            async with session.get(url) as response:
+                if response.status in RETRY_STATUSES and attempt < RETRY_TOTAL - 1:
+                    # Exponential backoff before retrying, matching urllib3's Retry timing
+                    await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                    continue
+
+                # Raise on 4xx/5xx (including retries that never recovered) so the
+                # failure surfaces as an exception rather than error-page text
+                response.raise_for_status()
+                return await response.text()
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def get_master_index(session, limiter, year, quarter):
+
+    """
+    This function returns the master.idx text for the given year/quarter, reusing a
+    local copy from CACHE_DIR when the quarter is already closed so repeated runs
+    skip the multi-MB download and the SEC rate-limit exposure that goes with it.
+    """
+
+    path = os.path.join(CACHE_DIR, f'{year}_{quarter}_master.idx')
+
+    # Reuse the cached index for closed quarters since those never change
+    if os.path.exists(path) and quarter_is_closed(year, quarter):
+        with open(path, encoding='utf-8') as cached:
+            return cached.read()
+
+    # Download SEC EDGAR master data file containing all company form submissions for specified year/quarter #
+    master_data = await fetch(
+        session, limiter, f'https://www.sec.gov/Archives/edgar/full-index/{year}/{quarter}/master.idx')
+
+    # Write through a temp file and atomically replace so a crashed run
+    # never leaves a truncated index behind
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as cached:
+        cached.write(master_data)
+    os.replace(temp_path, path)
+
+    return master_data
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def obtain_urls(year, quarter, form, total_forms, company_list):
+
+    """
+    This function obtains specified forms for provided companies from the SEC EDGAR Website
+
+    Input descriptions:
+    year: in format 20XX as an integer
+    quarter: as a string in format "QTR#" where # is 1, 2, 3, or 4
+    form: string that is either "8-K", "10-K" or "10-Q"
+    total_forms: the number of total forms to parse as an integer
+    company_list: is a dictionary where the key is the company's name as a string
+                  and the value is a list of strings in the form ['CIK#', 'Ticker']
+
+    Output will be a list of lists containing ['Form URL', 'Company Name', 'Company Ticker']
+    """
+
+    # Token bucket shared by every request in this run to honor SEC's rate guideline
+    limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+    # One pooled session for the whole run so every request after the first
+    # reuses its keep-alive connection to sec.gov
+    async with make_session() as session:
+
+        # Obtain SEC EDGAR master data file containing all company form submissions
+        # for specified year/quarter, from the local cache when possible
+        master_data = await get_master_index(session, limiter, year, quarter)
+
+        # Skip past the idx header (it ends with a dashed separator line) and parse
+        # the rest into a DataFrame once, instead of rescanning ~700K raw lines for
+        # every company in company_list
+        lines = master_data.split('\n')
+        data_start = next(i for i, line in enumerate(lines) if line.startswith('----')) + 1
+        idx = pd.read_csv(io.StringIO('\n'.join(lines[data_start:])), sep='|',
+                          names=['CIK', 'Name', 'Form', 'Date', 'Filename'])
+        idx['Filename'] = idx['Filename'].str.strip()
+
+        # Map each company's numeric CIK to its name and ticker. CIK is an exact key,
+        # so this replaces the name substring match that could hit unrelated filers
+        # (e.g. "Apple Inc." matching other companies with Apple in the name)
+        cik_to_info = {int(info[0]): (name, info[1]) for name, info in company_list.items()}
+
+        # Keep only the requested form type filed by the requested companies
+        idx = idx[(idx['Form'] == form) & (idx['CIK'].isin(cik_to_info))]
+
+        print(f"Matched {len(idx)} {form} filings for the provided companies.")
+
+        # create list to store the matching idx rows before fetching anything,
+        # so all the network round-trips can be issued in parallel afterwards.
+        # Obtain portion of url from each row to build full url later on,
+        # collecting only the specified total # of forms
+        matches = []
+        for row in idx.itertuples(index=False):
+            name, ticker = cik_to_info[row.CIK]
+            matches.append([row.Filename, name, ticker])
+
+            # Stop if we have the requested amount of forms
+            if len(matches) >= total_forms:
+                break
+
+        # Request each filing directory's compact index.json concurrently; it lists
+        # the documents directly, replacing the much larger .txt wrapper download
+        # that was only fetched to read its FILENAME tag
+        index_pages = await asyncio.gather(
+            *[fetch(session, limiter, ARCHIVE + TRIM.sub('', url) + '/index.json')
+              for url, name, ticker in matches],
+            return_exceptions=True)
+
+        # Generate the finalized .htm URLs from the directory listings
+        form_candidates = []
+        for (url, name, ticker), page in zip(matches, index_pages):
+            if isinstance(page, Exception):
+                print(f"Error fetching index for {ARCHIVE}{url}: {page}")
+                continue
+
+            # Pick the first .htm document in the directory, skipping EDGAR's own
+            # generated -index pages
+            directory = TRIM.sub('', url)
+            company_form_data = next(
+                (item['name'] for item in orjson.loads(page)['directory']['item']
+                 if item['name'].endswith('.htm') and '-index' not in item['name']),
+                None)
+            if company_form_data is None:
+                print(f"No .htm document listed for {ARCHIVE}{directory}")
+                continue
+
+            company_form_url = ARCHIVE + directory + '/' + company_form_data
+            form_candidates.append([company_form_url, name, ticker])
+
+        # Request the 8-K filing pages concurrently to confirm they are reachable,
+        # skipping any that error out
+        responses = await asyncio.gather(
+            *[fetch(session, limiter, company_form_url) for company_form_url, name, ticker in form_candidates],
+            return_exceptions=True)
+
+        # create list to store form urls
+        form_urls = []
+        for (company_form_url, name, ticker), response in zip(form_candidates, responses):
+            if isinstance(response, Exception):
+                print(f"Error fetching {company_form_url}: {response}")
+                continue
+
+            form_urls.append([company_form_url, name, ticker])
+            print(f"Found press release URL for {name}: {company_form_url}")
+
+    print(f"\nCollected {len(form_urls)} valid form {form} URLs.")
+
+    # Return the collected press release URLs
+    return form_urls
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def collect_json(stream):
+
+    """
+    This function accumulates streamed chat chunks and returns the generated text as
+    soon as the top-level JSON object closes. Structured output alone keeps generating
+    until EOS, so stopping at the matching closing brace saves the tail tokens of
+    every request. Tracks string and escape context so braces inside values are
+    not miscounted.
+    """
+
+    parts = []
+    depth = 0
+    started = False
+    in_string = False
+    escaped = False
+
+    async for chunk in stream:
+        piece = chunk.message.content
+
+        for position, character in enumerate(piece):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif character == '\\':
+                    escaped = True
+                elif character == '"':
+                    in_string = False
+            elif character == '"':
+                in_string = True
+            elif character == '{':
+                depth += 1
+                started = True
+            elif character == '}':
+                depth -= 1
+
+                # The top-level object just closed, so stop consuming the stream
+                # and let the remaining generation be cancelled
+                if started and depth == 0:
+                    parts.append(piece[:position + 1])
+                    return ''.join(parts)
+
+        parts.append(piece)
+
+    return ''.join(parts)
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def process_batch(client, batch, contents):
+
+    """
+    This function runs the llm over one already-downloaded batch of filings and
+    returns the validated BatchOutput.
+    """
+
+    # Create prompt covering the whole batch to provide as input to the llm
+    prompt = build_prompt(contents)
+
+    # Stream the response from the llm model and cut the generation off once
+    # the output JSON is complete
+    stream = await client.chat(model=MODEL, messages=[
+        {
+           'role': 'user',
+            'content': prompt
+        }
+    ],
+                               format=BatchOutput.model_json_schema(),
+                               # Sampling parameters must live in options; inside the
+                               # message dict the client silently ignored them
+                               options={'temperature': 0.2,
+                                        'top_k': 10,
+                                        'seed': 0,
+                                        'num_ctx': NUM_CTX,
+                                        'num_predict': NUM_PREDICT_PER_DOC * len(batch)},
+                               keep_alive=KEEP_ALIVE,
+                               stream=True,
+                               )
+    content = await collect_json(stream)
+
+    # Format llm response in specified format from BatchOutput class above.
+    # orjson decodes the JSON in C, leaving pydantic only the schema validation
+    return BatchOutput.model_validate(orjson.loads(content))
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def produce_batches(session, limiter, batches, queue):
+
+    """
+    This function is the producer side of the pipeline: it downloads each batch's
+    filings and queues them for the llm consumers. The bounded queue applies
+    backpressure so downloads stay only a few batches ahead of inference.
+    """
+
+    for batch in batches:
+
+        # Download the batch's file contents concurrently
+        contents = await asyncio.gather(*[fetch(session, limiter, line_info[0]) for line_info in batch])
+        await queue.put((batch, contents))
+
+    # One sentinel per consumer so they all shut down once the queue drains
+    for _ in range(MAX_CONCURRENT_CHATS):
+        await queue.put(None)
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def consume_batches(client, queue, writer, csvfile, progress):
+
+    """
+    This function is the consumer side of the pipeline: it pulls downloaded batches
+    off the queue, runs the llm over them, and writes the rows out. Running
+    MAX_CONCURRENT_CHATS consumers caps how many generations are in flight at once.
+    """
+
+    while True:
+        item = await queue.get()
+
+        # A sentinel from the producer means no more batches are coming
+        if item is None:
+            break
+
+        batch, contents = item
+        batch_output = await process_batch(client, batch, contents)
+
+        # The model can miscount and return the wrong number of items despite the
+        # prompt asking for exactly one per document; drop any extras and pad the
+        # missing ones with the no-product defaults so CSV rows stay 1:1 with the
+        # input filings instead of silently going missing
+        items = batch_output.items[:len(batch)]
+        if len(batch_output.items) != len(batch):
+            print(f"Warning: model returned {len(batch_output.items)} items for a batch "
+                  f"of {len(batch)} documents; padding with defaults.")
+            items.extend(DocumentOutput(date_of_report='', new_product='none',
+                                        product_description='No new products mentioned.')
+                         for _ in range(len(batch) - len(items)))
+
+        # Zip the model outputs back with the company metadata for this batch,
+        # flushing so rows already processed survive a crash
+        for line_info, doc_output in zip(batch, items):
+            writer.writerow(make_row(line_info, doc_output))
+        csvfile.flush()
+        progress.update(1)
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+def make_row(line_info, doc_output):
+
+    """
+    This function builds one CSV row from a filing's company metadata and its llm
+    output, filling in the defaults when the model incorrectly left a field blank.
+    """
+
+    new_product = doc_output.new_product.replace("&amp;", "and")
+    product_description = doc_output.product_description.replace("&amp;", "and")
+
+    # If any products or descriptions were incorrectly left blank, enter in
+    # correct description and name as none
+    if not new_product.strip():
+        new_product = "none"
+    if not product_description.strip():
+        product_description = "No new products mentioned."
+
+    return [line_info[1], line_info[2], doc_output.date_of_report, new_product, product_description]
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+async def parse_documents(batches, writer, csvfile):
+
+    """
+    This function wires the download producer and llm consumers together with a
+    bounded queue, so HTTP latency hides behind GPU time and vice versa, and writes
+    each batch's rows to the CSV as soon as that batch completes. Streaming rows out
+    keeps memory flat and preserves partial progress if a long run crashes partway
+    through the corpus.
+    """
+
+    client = AsyncClient()
+
+    # Warm the model into VRAM before the batches race for it, so the first
+    # real generations don't all block on a cold start from disk
+    await client.generate(model=MODEL, prompt='', keep_alive=KEEP_ALIVE)
+
+    # Token bucket shared by every request in this run to honor SEC's rate guideline
+    limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+    # Bounded queue connecting the downloader to the llm consumers
+    queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+
+    # Same pooled session setup as obtain_urls to respect SEC's request limit
+    async with make_session() as session:
+        with tqdm(total=len(batches)) as progress:
+            await asyncio.gather(
+                produce_batches(session, limiter, batches, queue),
+                *[consume_batches(client, queue, writer, csvfile, progress)
+                  for _ in range(MAX_CONCURRENT_CHATS)])
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+# Structured output classes for the llm response. BatchOutput wraps one
+# DocumentOutput per filing so several filings share a single chat call.
+class DocumentOutput(BaseModel):
+    date_of_report: str
+    new_product: str
+    product_description: str
+
+class BatchOutput(BaseModel):
+    items: list[DocumentOutput]
+
+# Number of filings packed into each chat call, sized by eye so the batch
+# fits the model context window with each filing capped at MAX_PROMPT_CHARS
+BATCH_SIZE = 4
+MAX_PROMPT_CHARS = 6000
+
+# Maximum number of llm generations in flight at once; this is the number of
+# consumer tasks pulling batches off the pipeline queue
+MAX_CONCURRENT_CHATS = 4
+
+# Bound on downloaded batches buffered between the producer and the llm consumers,
+# keeping downloads only a few batches ahead of inference
+QUEUE_MAXSIZE = 8
+
+# Hard ceiling on generated tokens per filing, scaled by the batch size when passed
+# to the model, so one runaway generation cannot stall a whole batch
+NUM_PREDICT_PER_DOC = 256
+
+# Keep the model resident in VRAM between calls so no chat pays a cold start
+KEEP_ALIVE = '30m'
+
+# Context window sized to what a full batch actually needs, so Ollama never
+# silently truncates the later documents or the trailing rules block: roughly
+# 1 token per 3 chars of document text plus the generation budget per filing,
+# with slack for the instruction header. Still well under the model default,
+# shrinking the KV cache so more generations fit on the GPU at once.
+NUM_CTX = BATCH_SIZE * (MAX_PROMPT_CHARS // 3 + NUM_PREDICT_PER_DOC) + 1024
+
+# Model used for parsing. A small Q4_K_M quantized instruct model keeps decode fast
+# and avoids the <think> reasoning prefix that deepseek-r1 emits and we discard.
+# Other models tried: llama3.2:3b, deepseek-r1:14b, deepseek-r1:8b
+MODEL = 'llama3.2:3b-instruct-q4_K_M'
+
+# 8-K items where new product announcements show up, in preference order
+ITEM_ANCHORS = ("Item 1.01", "Item 7.01", "Item 8.01")
+
+def extract_relevant_text(file_content):
+
+    """
+    This function strips the markup, CSS, and SEC boilerplate out of a filing and
+    returns the MAX_PROMPT_CHARS of visible text starting at the first 8-K item
+    anchor it finds. Shrinking the prompt this way cuts prefill cost several times
+    over versus feeding the raw .htm. Falls back to the start of the visible text
+    when no anchor is present, and to the raw content if extraction comes up empty.
+    """
+
+    clean = BeautifulSoup(file_content, 'lxml').get_text(' ', strip=True)
+
+    # Fall back to the raw content if the parse produced nothing visible
+    if not clean:
+        return file_content[:MAX_PROMPT_CHARS]
+
+    # Slice from the first item anchor found so the model sees the disclosure
+    # itself rather than the cover page
+    for anchor in ITEM_ANCHORS:
+        position = clean.find(anchor)
+        if position != -1:
+            return clean[position:position + MAX_PROMPT_CHARS]
+
+    return clean[:MAX_PROMPT_CHARS]
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+def build_prompt(contents):
+
+    """
+    This function builds a single prompt covering a batch of filings. The instruction
+    header and rules are shared once across the batch instead of repeated per filing,
+    and each filing is numbered so the model returns one output item per document.
+    """
+
+    document_sections = "\n---\n".join(
+        f"Document {i + 1}:\n{extract_relevant_text(content)}" for i, content in enumerate(contents))
+
+    return (
+            f"Read the following {len(contents)} documents and for EACH document provide the following details:\n"
+            f"- Date of the report\n"
+            f"- Name of new product mentioned\n"
+            f"- Description of the new product\n\n"
+            f"{document_sections}\n\n"
+            f"Return a JSON object whose \"items\" array contains exactly {len(contents)} entries, "
+            f"one per document in the order given above.\n\n"
+            f"IMPORTANT RULES:\n"
+            f"1. The New Product Description MUST be summarized in 180 characters or less.\n"
+            f"2. Generic product names such as 'New Product 1' or similar names are NOT considered new products. Only list products with specific names.\n"
+            f"3. Acquiring another business or business unit is NOT considered a new product.\n"
+            f"4. If no new products are mentioned, output the following:\n"
+            f"   - New Product: none\n"
+            f"   - Product Description: No new products mentioned.\n"
+            f"5. Senior notes due or common stock are NOT considered new products. .\n"
+        )
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+def llm_parser(documents, csv_path='testoutput.csv'):
+    """
+    This function takes a list containing lists [urls, stock names,tickers] as input and
+    streams the llm output for each company form url straight to the CSV at csv_path.
+    """
+
+    # Timing how long total llm parsing and output will take
+    start_time = time.time()
+
+    # Split the urls obtained from obtain_urls function into batches, then run
+    # download + llm inference for all batches concurrently so the network fetches
+    # overlap with the GPU generations
+    batches = [documents[start:start + BATCH_SIZE] for start in range(0, len(documents), BATCH_SIZE)]
+
+    # Write the results from the llm to the CSV file as they are produced
+    with open(csv_path, "w", newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["company_name", "stock_name", "filing_time", "new_product", "product_description"])
+        asyncio.run(parse_documents(batches, writer, csvfile))
+
+    # calculate total time for llm chat responses
+    elapsed_time = time.time() - start_time
+    print(f"Time taken for the chat operation: {elapsed_time:.2f} seconds")
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+if __name__ == "__main__":
+
+    # Read in SPY500 company data to obtain names, ciks, and tickers, reusing the
+    # cached copy while it is fresh to skip the Wikipedia fetch and HTML parse
+    spy500_path = os.path.join(CACHE_DIR, 'spy500.parquet')
+    if os.path.exists(spy500_path) and time.time() - os.path.getmtime(spy500_path) < SPY500_MAX_AGE:
+        tickers = pd.read_parquet(spy500_path)
+    else:
+        tickers = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tickers.to_parquet(spy500_path)
+
+    # Create dictionary of company names, ciks, and tickers, adding leading 0s to
+    # CIKs per SEC website guidance. itertuples avoids the per-row, per-column
+    # .iloc lookups of the old loop and builds the dict in a single pass
+    spy_companies = {str(row.Security): [str(row.CIK).zfill(10), str(row.Symbol)]
+                     for row in tickers.itertuples(index=False)}
+
+    # Running the functions on the dictionary of requested companies
+    # In this case, we are using SPY500 companies
+
+    # Available form requests: '8-K', '10-K', or '10-Q'
+    url_list = asyncio.run(obtain_urls(2024, "QTR4", "8-K", 100, spy_companies))
+    llm_parser(url_list)